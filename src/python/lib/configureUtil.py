@@ -61,10 +61,18 @@ def safeSetBool(obj,dataname) :
 def pickleConfigSections(pickleConfigFile, configSections) :
     """
     write configSections object, expected to be a hash or hashes, into a pickle file
+
+    The pickle protocol is fixed at 2, because the run script reading this file may be
+    executed by a different python interpreter than configure, and protocol 2 is the
+    highest that every supported (2.6+) interpreter can load.
     """
     import pickle
 
-    pickle.dump(configSections, open(pickleConfigFile, "wb"))
+    pfp=open(pickleConfigFile, "wb")
+    try :
+        pickle.dump(configSections, pfp, protocol=2)
+    finally :
+        pfp.close()
 
 
 
@@ -77,7 +85,11 @@ def getConfigSections(pickleConfigFile) :
 
     if not os.path.isfile(pickleConfigFile) : return {}
 
-    return pickle.load(open(pickleConfigFile, "rb"))
+    pfp=open(pickleConfigFile, "rb")
+    try :
+        return pickle.load(pfp)
+    finally :
+        pfp.close()
 
 
 
@@ -48,53 +48,54 @@ def makeRunScript(scriptFile, workflowModulePath, workflowClassName, primaryConf
 
     workflowModulePath=os.path.abspath(workflowModulePath)
     workflowModuleDir=os.path.dirname(workflowModulePath)
-    workflowModuleName=os.path.basename(workflowModulePath)
-    pyExt=".py"
-    if workflowModuleName.endswith(pyExt) :
-        workflowModuleName=workflowModuleName[:-len(pyExt)]
+    workflowModuleName=os.path.splitext(os.path.basename(workflowModulePath))[0]
 
     # dump inisections to a file
     pickleConfigFile=scriptFile+".config.pickle"
     pickleConfigSections(pickleConfigFile,configSections)
 
-    sfp=open(scriptFile,"w")
-
     if pythonBin is None :
         pythonBin="/usr/bin/env python"
 
-    sfp.write(runScript1 % (pythonBin, " ".join(sys.argv),workflowModuleDir,workflowModuleName,workflowClassName))
+    # assemble the full script in memory so that it is written out in a single call:
+    scriptParts=[runScript1.format(pythonBin=pythonBin,
+                                   cmdline=" ".join(sys.argv),
+                                   workflowModuleDir=workflowModuleDir,
+                                   workflowModuleName=workflowModuleName,
+                                   workflowClassName=workflowClassName),
+                 runScript2,
+                 runScript3,
+                 'main(r"%s","%s",%s)\n' % (pickleConfigFile, primaryConfigSection, workflowClassName)]
 
-    sfp.write('\n')
-    sfp.write(runScript2)
-    sfp.write('\n')
-    sfp.write(runScript3)
-    sfp.write('\n')
+    with open(scriptFile,"w") as sfp :
+        sfp.write("\n".join(scriptParts) + "\n")
 
-    sfp.write('main(r"%s","%s",%s)\n' % (pickleConfigFile, primaryConfigSection, workflowClassName))
-    sfp.write('\n')
-    sfp.close()
-    os.chmod(scriptFile,0o755)
+    # an existing run script which is being overwritten may already have the right permissions:
+    runScriptMode=0o755
+    if (os.stat(scriptFile).st_mode & 0o777) != runScriptMode :
+        os.chmod(scriptFile,runScriptMode)
 
 
 
-runScript1="""#!%s
-# Workflow run script auto-generated by command: '%s'
+# runScript1 is filled in with str.format named fields, so any literal braces added here must be doubled:
+runScript1="""#!{pythonBin}
+# Workflow run script auto-generated by command: '{cmdline}'
 #
 
 import os, sys
 
 #if sys.version_info >= (3,0):
 #    import platform
-#    raise Exception("Strelka does not currently support python3 (version %%s detected)" %% (platform.python_version()))
+#    raise Exception("Strelka does not currently support python3 (version %s detected)" % (platform.python_version()))
 #
 if sys.version_info < (2,6):
     import platform
-    raise Exception("Strelka requires python2 version 2.6+ (version %%s detected)" %% (platform.python_version()))
+    raise Exception("Strelka requires python2 version 2.6+ (version %s detected)" % (platform.python_version()))
 
 scriptDir=os.path.abspath(os.path.dirname(__file__))
-sys.path.append(r'%s')
+sys.path.append(r'{workflowModuleDir}')
 
-from %s import %s
+from {workflowModuleName} import {workflowClassName}
 
 """
 
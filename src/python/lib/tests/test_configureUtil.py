@@ -53,3 +53,19 @@ class test_configureUtil(unittest.TestCase):
             configureUtil.checkForBamExtension("foo.cram")
         except :
             self.fail("Method raised unexpected exception")
+
+    def test_pickleConfigSections(self):
+        import shutil
+        import tempfile
+
+        tmpDir=tempfile.mkdtemp()
+        try :
+            pickleConfigFile=os.path.join(tmpDir,"config.pickle")
+            configSections={ "foo" : { "bar" : "1", "baz" : 2 } }
+            configureUtil.pickleConfigSections(pickleConfigFile,configSections)
+            pfp=open(pickleConfigFile,"rb")
+            self.assertEqual(pfp.read(2),b"\x80\x02")
+            pfp.close()
+            self.assertEqual(configureUtil.getConfigSections(pickleConfigFile),configSections)
+        finally :
+            shutil.rmtree(tmpDir)
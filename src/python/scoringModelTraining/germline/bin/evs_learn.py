@@ -27,10 +27,16 @@ __author__ = "Peter Krusche <pkrusche@illumina.com>"
 
 import os
 import sys
-import json
 
+import numpy
 import pandas
 
+try :
+    # faster JSON parsing if available:
+    from orjson import loads as loadJson
+except ImportError :
+    from json import loads as loadJson
+
 scriptDir = os.path.abspath(os.path.dirname(__file__))
 workflowDir = os.path.abspath(
     os.path.join(scriptDir, "../lib"))
@@ -41,7 +47,6 @@ sys.path.append(workflowDir)
 import evs
 import evs.tools
 import evs.features
-import random
 
 def parseArgs():
     import argparse
@@ -77,6 +82,9 @@ def parseArgs():
     parser.add_argument("--sample-input", dest="sample_input", default=0, type=int,
                         help="Number of rows to subsample from each input data file")
 
+    parser.add_argument("--seed", default=0, type=int,
+                        help="Random seed used for subsampling and balancing the input data")
+
     parser.add_argument("--plots", default=False, action="store_true",
                         help="Make plots.")
 
@@ -104,7 +112,16 @@ def parseArgs():
     return args
 
 
-def getDataSet(inputs, args) :
+def sampleRows(df, nrows, rng) :
+    """
+    Return nrows rows of df, selected uniformly at random without replacement
+
+    Rows are selected by position, so this is also correct for frames with duplicate index labels.
+    """
+    return df.iloc[numpy.sort(rng.choice(df.shape[0], nrows, replace=False))]
+
+
+def getDataSet(inputs, args, rng) :
 
     datasets = []
     for inputFile in inputs:
@@ -116,9 +133,8 @@ def getDataSet(inputs, args) :
         df = df[df["tag"] != "FN"]
 
         if args.sample_input:
-            p_rows = min(df.shape[0], sample_input)
-            p_rows_selected = random.sample(df.index, p_rows)
-            df = pandas.DataFrame(df.ix[p_rows_selected])
+            p_rows = min(df.shape[0], args.sample_input)
+            df = sampleRows(df, p_rows, rng)
 
         if args.balance_per_sample:
             tps = df[df["tag"] == "TP"]
@@ -129,19 +145,12 @@ def getDataSet(inputs, args) :
             else:
                 print(("TP: %d FP: %d" % (tps.shape[0], fps.shape[0])))
             if tps.shape[0] < fps.shape[0]:
-                rows_selected = random.sample(fps.index, tps.shape[0])
-                fps = pandas.DataFrame(fps.ix[rows_selected])
+                fps = sampleRows(fps, tps.shape[0], rng)
             elif fps.shape[0] < tps.shape[0]:
-                rows_selected = random.sample(tps.index, fps.shape[0])
-                tps = pandas.DataFrame(tps.ix[rows_selected])
+                tps = sampleRows(tps, fps.shape[0], rng)
 
-            if tps.shape[0] < fps.shape[0]:
-                fps = fps.sample(n=tps.shape[0])
-            elif fps.shape[0] < tps.shape[0]:
-                tps = tps.sample(n=fps.shape[0])
             if args.ambig:
-                rows_selected = random.sample(ambigs.index, fps.shape[0])
-                ambigs = pandas.DataFrame(ambigs.ix[rows_selected])
+                ambigs = sampleRows(ambigs, fps.shape[0], rng)
                 print(("Downsampled to TP: %d,  FP: %d, UNK: %d" % (tps.shape[0], fps.shape[0], ambigs.shape[0])))
                 df = pandas.concat([tps, fps, ambigs])
             else:
@@ -170,14 +179,17 @@ def main():
 
     pars = {}
     if args.parameters :
-        pars = json.load(open(args.parameters))
+        with open(args.parameters, "rb") as parameterFile :
+            pars = loadJson(parameterFile.read())
         print(("Using custom learning parameters: %s" % str(pars)))
     else :
         print("Using default learning parameters.")
 
     model = evs.EVSModel.createNew(args.model)
 
-    dataset = getDataSet(args.inputs, args)
+    rng = numpy.random.default_rng(args.seed)
+
+    dataset = getDataSet(args.inputs, args, rng)
 
     if (not args.balance_overall) or args.balance_per_sample:
         # the copy() method calls below help to prevent the SettingWithCopy warning in pandas
@@ -194,10 +206,8 @@ def main():
         else:
             fpdata2 = dataset[dataset["tag"] == "FP"]
         nrows = min(tpdata2.shape[0], fpdata2.shape[0])
-        tp_rows_selected = random.sample(tpdata2.index, nrows)
-        fp_rows_selected = random.sample(fpdata2.index, nrows)
-        tpdata = tpdata2.ix[tp_rows_selected].copy()
-        fpdata = fpdata2.ix[fp_rows_selected].copy()
+        tpdata = sampleRows(tpdata2, nrows, rng).copy()
+        fpdata = sampleRows(fpdata2, nrows, rng).copy()
 
     if args.ambig:
         fpcounts = fpdata["tag"].value_counts()
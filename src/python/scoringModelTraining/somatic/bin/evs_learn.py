@@ -27,10 +27,16 @@ __author__ = "Peter Krusche <pkrusche@illumina.com>"
 
 import os
 import sys
-import json
 
+import numpy
 import pandas
 
+try :
+    # faster JSON parsing if available:
+    from orjson import loads as loadJson
+except ImportError :
+    from json import loads as loadJson
+
 scriptDir = os.path.abspath(os.path.dirname(__file__))
 workflowDir = os.path.abspath(os.path.join(scriptDir, "../lib"))
 
@@ -40,7 +46,6 @@ sys.path.append(workflowDir)
 import evs
 import evs.tools
 import evs.features
-import random
 
 def parseArgs():
     import argparse
@@ -76,6 +81,13 @@ def parseArgs():
     parser.add_argument("--sample-input", dest="sample_input", default=0, type=int,
                         help="Number of rows to subsample from each input data file")
 
+    parser.add_argument("--seed", default=0, type=int,
+                        help="Random seed used for subsampling and balancing the input data")
+
+    parser.add_argument("--cache-dir", dest="cacheDir",
+                        help="Cache parsed input files in this directory as parquet files, so that later runs on the same"
+                             " inputs can skip CSV parsing (requires pyarrow)")
+
     parser.add_argument("--plots", default=False, action="store_true",
                         help="Make plots.")
 
@@ -97,57 +109,211 @@ def parseArgs():
 
     checkOptionalFile(args.parameters, "training model parameter")
 
+    if args.cacheDir is not None :
+        try :
+            import pyarrow  # noqa
+        except ImportError :
+            raise Exception("Input cache directory requires the pyarrow module")
+        if not os.path.isdir(args.cacheDir) :
+            os.makedirs(args.cacheDir)
+
     return args
 
 
 
-def getDataSet(inputs, sample_input, balance_per_sample) :
+def falseNegativeMask(df) :
+    """
+    Return a boolean mask of the FN rows, comparing the integer codes of the categorical tag column
+    """
+    tags = df["tag"].cat.categories
+    if "FN" not in tags :
+        return numpy.zeros(df.shape[0], dtype=bool)
+    return df["tag"].cat.codes.values == tags.get_loc("FN")
+
+
+
+def loadCachedFeatures(inputFile, usecols, dtype, cacheDir) :
+    """
+    Read one labeled feature CSV file (all rows, false negatives removed) through a parquet cache
+
+    The cache file name is derived from the CSV path, modification time and size and from
+    the selected columns, so any change to the input or feature set produces a new entry.
+    """
+    import hashlib
+
+    key = "%s:%r:%d:%s" % (inputFile, os.path.getmtime(inputFile), os.path.getsize(inputFile), ",".join(usecols))
+    key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    cacheFile = os.path.join(cacheDir, "%s.%s.parquet" % (os.path.basename(inputFile), key))
+
+    if os.path.isfile(cacheFile) :
+        print(("Using cached '%s'" % (cacheFile)))
+        return pandas.read_parquet(cacheFile)
+
+    df = pandas.read_csv(inputFile, engine="c", usecols=usecols, dtype=dtype, low_memory=False)
+    df = df[~falseNegativeMask(df)]
+
+    # write to a temporary file first so that an interrupted run can't leave a truncated cache entry:
+    tmpFile = cacheFile + ".tmp.%d" % (os.getpid())
+    df.to_parquet(tmpFile, compression="snappy")
+    os.rename(tmpFile, cacheFile)
+    return df
+
+
+
+def sampleRows(df, nrows, rng) :
+    """
+    Return nrows rows of df, selected uniformly at random without replacement
+
+    The selected positions are sorted so that the row gather reads the frame in order.
+    """
+    return df.iloc[numpy.sort(rng.choice(df.shape[0], nrows, replace=False))]
+
+
+
+def readLabeledFeatures(inputFile, usecols, dtype, sample_input, rng, cacheDir=None, chunksize=200000) :
+    """
+    Read one labeled feature CSV file
+
+    If sample_input is non-zero, the file is streamed in chunks and a uniform random
+    subset of at most sample_input non-FN rows is kept (bottom-k sampling on a random key),
+    so that memory use is bounded by the sample size instead of the file size.
+
+    If cacheDir is given, the full file is read through the parquet cache instead. Otherwise
+    the full file is returned as parsed, and false negatives are left for selectTrainingRows
+    to skip.
+    """
+    if cacheDir is not None :
+        return loadCachedFeatures(inputFile, usecols, dtype, cacheDir)
+
+    if not sample_input :
+        return pandas.read_csv(inputFile, engine="c", usecols=usecols, dtype=dtype, low_memory=False)
 
-    import random
-    datasets = []
+    # Rows are buffered and only reduced to the sample_input smallest keys once the buffer
+    # exceeds twice the sample size. After that, the largest retained key is a threshold
+    # that any later row must beat, so most rows of a large file are dropped per chunk:
+    sampleKey = "_sample_key"
+    buffered = []
+    bufferedRows = 0
+    threshold = None
+    for chunk in pandas.read_csv(inputFile, engine="c", usecols=usecols, dtype=dtype, chunksize=chunksize) :
+        keys = rng.random(chunk.shape[0])
+        keep = ~falseNegativeMask(chunk)
+        if threshold is not None :
+            keep &= (keys < threshold)
+        chunk = chunk[keep].assign(**{sampleKey : keys[keep]})
+        buffered.append(chunk)
+        bufferedRows += chunk.shape[0]
+        if bufferedRows > 2 * sample_input :
+            df = pandas.concat(buffered).nsmallest(sample_input, sampleKey)
+            threshold = df[sampleKey].max()
+            buffered = [df]
+            bufferedRows = df.shape[0]
+
+    df = pandas.concat(buffered)
+    if df.shape[0] > sample_input :
+        df = df.nsmallest(sample_input, sampleKey)
+    df = df.drop(columns=sampleKey)
+    # chunks may have seen different tag values, so rebuild the categories for the sample:
+    df["tag"] = df["tag"].astype(str).astype("category")
+    return df
+
+
+
+def selectTrainingRows(df, features, sample_input, balance_per_sample, rng) :
+    """
+    Select the (TP, FP) training rows of one input file
+
+    False negative removal, subsampling, the TP/FP split and per-file balancing are all done
+    on integer row positions. Only the selected rows of each feature column are then copied
+    into the returned (rows x features) float32 arrays, so no full-size copy of the file's
+    feature values is made.
+    """
+    categories = df["tag"].cat.categories
+    codes = df["tag"].cat.codes.values
+
+    def tagRows(rows, tag) :
+        if tag not in categories :
+            return rows[0:0]
+        return rows[codes[rows] == categories.get_loc(tag)]
+
+    def sample(rows, nrows) :
+        return numpy.sort(rng.choice(rows, nrows, replace=False))
+
+    # Remove false negatives before any subsampling:
+    rows = numpy.flatnonzero(~falseNegativeMask(df))
+
+    if sample_input and rows.shape[0] > sample_input:
+        rows = sample(rows, sample_input)
+
+    tpRows = tagRows(rows, "TP")
+    fpRows = tagRows(rows, "FP")
+
+    if balance_per_sample:
+        print(("TP: %d FP: %d" % (tpRows.shape[0], fpRows.shape[0])))
+        if tpRows.shape[0] < fpRows.shape[0]:
+            fpRows = sample(fpRows, tpRows.shape[0])
+        elif fpRows.shape[0] < tpRows.shape[0]:
+            tpRows = sample(tpRows, fpRows.shape[0])
+        print(("Downsampled to TP: %d FP: %d" % (tpRows.shape[0], fpRows.shape[0])))
+
+    def gatherRows(rows) :
+        return numpy.column_stack([df[feature].values[rows] for feature in features])
+
+    return gatherRows(tpRows), gatherRows(fpRows)
+
+
+
+def makeTrainingFrame(valueSets, weightSets, features) :
+    """
+    Combine per-file feature arrays and weights into the data frame passed to model training
+
+    The arrays are concatenated in numpy, so the data frame is only created once.
+    """
+    frame = pandas.DataFrame(numpy.concatenate(valueSets), columns=features)
+    frame["weight"] = numpy.concatenate(weightSets)
+    return frame
+
+
+
+def getDataSet(inputs, features, sample_input, balance_per_sample, rng, cacheDir=None) :
+    """
+    Read all input files and return (TP, FP) data frames with the feature and weight columns
+
+    Each file is reduced to plain TP and FP feature arrays, which are only turned into
+    data frames after all files have been read.
+    """
+
+    tpValues, tpWeights = [], []
+    fpValues, fpWeights = [], []
     admixWeight = 1
     nnWeight = 1
 
+    # Only parse the columns used for training, with fixed types so that pandas
+    # does not need to infer them (float32 is also what the sklearn trees use internally):
+    usecols = list(features) + ["tag"]
+    dtype = dict((feature, "float32") for feature in features)
+    dtype["tag"] = "category"
+
     for inputFile in inputs:
         inputFile = os.path.abspath(inputFile)
         print(("Reading '%s'" % (inputFile)))
-        df = pandas.read_csv(inputFile)
-        # Remove false negatives before any subsampling:
-        df = df[df["tag"] != "FN"]
-
-        if sample_input:
-            p_rows = min(df.shape[0], sample_input)
-            p_rows_selected = random.sample(df.index, p_rows)
-            df = pandas.DataFrame(df.ix[p_rows_selected])
-
-        if balance_per_sample:
-            tps = df[df["tag"] == "TP"]
-            fps = df[df["tag"] == "FP"]
-            print(("TP: %d FP: %d" % (tps.shape[0], fps.shape[0])))
-            if tps.shape[0] < fps.shape[0]:
-                rows_selected = random.sample(fps.index, tps.shape[0])
-                fps = pandas.DataFrame(fps.ix[rows_selected])
-            elif fps.shape[0] < tps.shape[0]:
-                rows_selected = random.sample(tps.index, fps.shape[0])
-                tps = pandas.DataFrame(tps.ix[rows_selected])
-            print(("Downsampled to TP: %d FP: %d" % (tps.shape[0], fps.shape[0])))
-            df = pandas.concat([tps, fps])
-
-        df["weight"] = 1
+        df = readLabeledFeatures(inputFile, usecols, dtype, sample_input, rng, cacheDir)
+
+        weight = 1
         if "Admix" in inputFile:
-            df["weight"] = admixWeight
+            weight = admixWeight
             print(("Admixture: setting weight to %f" % admixWeight))
         if "NN" in inputFile:
-            df["weight"] = nnWeight
+            weight = nnWeight
             print(("Normal-normal: setting weight to %f" % nnWeight))
-        datasets.append(df)
 
-    if len(datasets) > 1:
-        dataset = pandas.concat(datasets)
-    else:
-        dataset = datasets[0]
+        tps, fps = selectTrainingRows(df, features, sample_input, balance_per_sample, rng)
+        tpValues.append(tps)
+        tpWeights.append(numpy.full(tps.shape[0], weight, dtype=numpy.float32))
+        fpValues.append(fps)
+        fpWeights.append(numpy.full(fps.shape[0], weight, dtype=numpy.float32))
 
-    return pandas.DataFrame(dataset)
+    return makeTrainingFrame(tpValues, tpWeights, features), makeTrainingFrame(fpValues, fpWeights, features)
 
 
 
@@ -162,26 +328,22 @@ def main():
 
     pars = {}
     if args.parameters :
-        pars = json.load(open(args.parameters))
+        with open(args.parameters, "rb") as parameterFile :
+            pars = loadJson(parameterFile.read())
         print(("Using custom learning parameters: %s" % str(pars)))
     else :
         print("Using default learning parameters.")
 
     model = evs.EVSModel.createNew(args.model)
 
-    dataset = getDataSet(args.inputs, args.sample_input, args.balance_per_sample)
-
-    if (not args.balance_overall) or args.balance_per_sample:
-        tpdata = dataset[dataset["tag"] == "TP"]
-        fpdata = dataset[dataset["tag"] == "FP"]
-    else:
-        tpdata2 = dataset[dataset["tag"] == "TP"]
-        fpdata2 = dataset[dataset["tag"] == "FP"]
-        nrows = min(tpdata2.shape[0], fpdata2.shape[0])
-        tp_rows_selected = random.sample(tpdata2.index, nrows)
-        fp_rows_selected = random.sample(fpdata2.index, nrows)
-        tpdata = tpdata2.ix[tp_rows_selected]
-        fpdata = fpdata2.ix[fp_rows_selected]
+    rng = numpy.random.default_rng(args.seed)
+
+    tpdata, fpdata = getDataSet(args.inputs, features, args.sample_input, args.balance_per_sample, rng, args.cacheDir)
+
+    if args.balance_overall and not args.balance_per_sample:
+        nrows = min(tpdata.shape[0], fpdata.shape[0])
+        tpdata = sampleRows(tpdata, nrows, rng)
+        fpdata = sampleRows(fpdata, nrows, rng)
 
     model.train(tpdata, fpdata, features, **pars)
     model.save(args.output)